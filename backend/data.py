@@ -1,328 +1,555 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.sql.elements import TextClause
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from sqlalchemy.ext.declarative import declarative_base
-import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-import folium
+import functools
+import logging
 import os
-
-DATABASE_URL = "sqlite:///flights.sqlite3"
-engine = create_engine(DATABASE_URL, echo=True)
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+DATABASE_FILE = "flights.sqlite3"
+DATABASE_URL = f"sqlite:///{DATABASE_FILE}"
+# SQL statement logging, for development only (SQL_ECHO=1)
+SQL_ECHO = os.getenv("SQL_ECHO") == "1"
+# One engine (and connection pool) shared by every request
+engine = create_engine(
+    DATABASE_URL,
+    echo=SQL_ECHO,
+    connect_args={"check_same_thread": False},
+    pool_size=10,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Separate, unpooled engine for the few statements that write to the database (build step, summary refresh)
+maintenance_engine = create_engine(DATABASE_URL, echo=SQL_ECHO, poolclass=NullPool)
 Base = declarative_base()
 
+logger = logging.getLogger(__name__)
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    """
+    Tunes every new SQLite connection of the API engine for the read-heavy workload.
+
+    The large page cache and memory map keep the working set in memory, busy_timeout lets a read
+    wait out a maintenance write instead of failing with "database is locked", and query_only guards
+    against accidental writes, since requests never modify the database. Only per-connection settings
+    are applied here; the WAL journal mode is stored in the database file and set by the build step.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-262144")  # 256 MB
+    cursor.execute("PRAGMA mmap_size=1073741824")  # 1 GB
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA busy_timeout=5000")  # 5 s
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+@event.listens_for(maintenance_engine, "connect")
+def _use_explicit_transactions(dbapi_connection, connection_record):
+    """
+    Turns off the transaction handling of pysqlite for the maintenance engine.
+
+    pysqlite never emits BEGIN before DDL, so every CREATE/DROP/ALTER would commit on its own;
+    the transactions are begun by the "begin" listener below instead, and then cover all statements.
+    """
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+@event.listens_for(maintenance_engine, "begin")
+def _begin_immediate(connection):
+    """
+    Begins every maintenance transaction with BEGIN IMMEDIATE, taking the write lock up front.
+    """
+    connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+# Indexes backing the hot WHERE/JOIN columns of the FlightData queries
+INDEXES = {
+    "idx_flights_date": "CREATE INDEX IF NOT EXISTS idx_flights_date ON flights(YEAR, MONTH, DAY)",
+    "idx_flights_airline_delay": "CREATE INDEX IF NOT EXISTS idx_flights_airline_delay ON flights(AIRLINE, DEPARTURE_DELAY)",
+    "idx_flights_origin_delay": "CREATE INDEX IF NOT EXISTS idx_flights_origin_delay ON flights(ORIGIN_AIRPORT, DEPARTURE_DELAY)",
+    "idx_flights_dep_hour": "CREATE INDEX IF NOT EXISTS idx_flights_dep_hour ON flights(DEP_HOUR, DEPARTURE_DELAY)",
+    "idx_airlines_name_lower": "CREATE INDEX IF NOT EXISTS idx_airlines_name_lower ON airlines(LOWER(airline))",
+}
+
+
+# Flight counts per airline and route, collected in a single pass over the flights table.
+# The airline and route summaries are both derived from it; the table is read sequentially (NOT INDEXED),
+# which is faster than walking it through an index that doesn't cover the grouping.
+FLIGHT_COUNTS_QUERY = """
+SELECT 
+    flights.airline AS airline_id,
+    flights.origin_airport AS origin,
+    flights.destination_airport AS destination,
+    COUNT(flights.id) AS total_flights,
+    SUM(CASE WHEN flights.departure_delay > 20 THEN 1 ELSE 0 END) AS delayed_flights
+FROM flights NOT INDEXED
+GROUP BY flights.airline, origin, destination
+"""
+
+# Pre-aggregated summary tables ("materialized views") backing the plots and the hourly endpoint.
+# The hourly table keeps the departure delay as a grouping key so delay thresholds can still be applied;
+# it is built from the covering DEP_HOUR index and doesn't touch the table pages at all.
+SUMMARY_TABLES = {
+    "mv_airline_delays": """
+    SELECT 
+        airlines.airline AS airline, 
+        SUM(flight_counts.total_flights) AS total_flights,
+        SUM(flight_counts.delayed_flights) AS delayed_flights
+    FROM temp.flight_counts
+    JOIN airlines ON flight_counts.airline_id = airlines.id
+    GROUP BY airlines.airline
+    """,
+    "mv_hour_delays": """
+    SELECT 
+        flights.dep_hour AS hour,
+        flights.departure_delay AS departure_delay,
+        COUNT(flights.id) AS total_flights,
+        SUM(CASE WHEN flights.departure_delay > 20 THEN 1 ELSE 0 END) AS delayed_flights
+    FROM flights
+    GROUP BY hour, flights.departure_delay
+    """,
+    "mv_route_delays": """
+    SELECT 
+        origin,
+        destination,
+        SUM(total_flights) AS total_flights,
+        SUM(delayed_flights) AS delayed_flights
+    FROM temp.flight_counts
+    GROUP BY origin, destination
+    """,
+}
+
+
+# Fills in the departure hour of the flights that don't have one yet (all of them when the column was just added)
+BACKFILL_DEPARTURE_HOUR = """
+UPDATE flights SET DEP_HOUR = CAST(substr(SCHEDULED_DEPARTURE, 1, 2) AS INTEGER)
+WHERE DEP_HOUR IS NULL
+"""
+
+
+def _existing_objects(connection, object_type: str):
+    """
+    Returns the names of the tables or indexes that already exist in the database.
+    """
+    query = text("SELECT name FROM sqlite_master WHERE type = :type")
+    return {row[0] for row in connection.execute(query, {"type": object_type})}
+
+
+def create_departure_hour_column():
+    """
+    Adds the integer DEP_HOUR column (hour of the scheduled departure) to the flights table if it is missing.
+
+    The hour is computed once at write time, so hour based queries don't have to parse
+    SCHEDULED_DEPARTURE for every row.
+    """
+    with maintenance_engine.begin() as connection:
+        columns = {row[1].upper() for row in connection.execute(text("PRAGMA table_info(flights)"))}
+        if "DEP_HOUR" not in columns:
+            connection.execute(text("ALTER TABLE flights ADD COLUMN DEP_HOUR INTEGER"))
+            connection.execute(text(BACKFILL_DEPARTURE_HOUR))
+
+
+def create_indexes():
+    """
+    Creates the indexes used by the FlightData queries if they don't exist yet.
+
+    The planner statistics are refreshed with ANALYZE whenever a new index was built,
+    so SQLite picks the composite indexes over a full table scan.
+    """
+    with maintenance_engine.begin() as connection:
+        existing = _existing_objects(connection, "index")
+        missing = [name for name in INDEXES if name not in existing]
+        for name in missing:
+            connection.execute(text(INDEXES[name]))
+        if missing:
+            connection.execute(text("ANALYZE"))
+
+
+def create_summary_tables(rebuild: bool = False):
+    """
+    Builds the pre-aggregated summary tables if they don't exist yet.
+
+    The flight data is static at query time, so the aggregates only have to be computed once
+    instead of scanning the whole flights table on every request. All tables are built from one
+    scan of the flights table (plus the hour index) in one transaction, which includes the DDL
+    statements since the maintenance engine begins its transactions explicitly (see above).
+
+    Args:
+        rebuild: Drop and rebuild all summary tables, e.g. after the flights table was updated.
+            The DEP_HOUR of newly loaded flights is filled in first, in the same transaction.
+            Readers keep seeing the old tables until the transaction commits (the build step switches
+            the database to WAL, so they aren't blocked meanwhile).
+    """
+    with maintenance_engine.begin() as connection:
+        if rebuild:
+            # Flights loaded since the DEP_HOUR column was added don't have their hour yet
+            connection.execute(text(BACKFILL_DEPARTURE_HOUR))
+            for name in SUMMARY_TABLES:
+                connection.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            missing = list(SUMMARY_TABLES)
+        else:
+            existing = _existing_objects(connection, "table")
+            missing = [name for name in SUMMARY_TABLES if name not in existing]
+        if not missing:
+            return
+        connection.execute(text(f"CREATE TEMP TABLE flight_counts AS {FLIGHT_COUNTS_QUERY}"))
+        for name in missing:
+            connection.execute(text(f"CREATE TABLE {name} AS {SUMMARY_TABLES[name]}"))
+        connection.execute(text("DROP TABLE temp.flight_counts"))
+
+
+def refresh_summary_tables():
+    """
+    Rebuilds the summary tables from the current flights table and drops the cached query results.
+
+    The database file is touched as well, so the generated plots are older than the database and get regenerated,
+    even if the rebuild still sits in the write-ahead log, and the query results cached by the other worker
+    processes no longer match (see cached_query).
+    """
+    create_summary_tables(rebuild=True)
+    query_cache.clear()
+    os.utime(DATABASE_FILE)
+
+
+def check_database():
+    """
+    Checks that the database was prepared by the build step (python data.py), without writing to it.
+
+    Missing indexes only make the queries slower and are logged, missing summary tables break the API.
+
+    Raises:
+        RuntimeError: If summary tables are missing.
+    """
+    with engine.connect() as connection:
+        tables = _existing_objects(connection, "table")
+        indexes = _existing_objects(connection, "index")
+    missing_tables = [name for name in SUMMARY_TABLES if name not in tables]
+    if missing_tables:
+        raise RuntimeError(f"Summary tables {', '.join(missing_tables)} are missing in {DATABASE_FILE}; "
+                           f"prepare the database with 'python data.py' first.")
+    missing_indexes = [name for name in INDEXES if name not in indexes]
+    if missing_indexes:
+        logger.warning("Indexes %s are missing in %s; run 'python data.py' to create them.",
+                       ", ".join(missing_indexes), DATABASE_FILE)
+
+
+def build_database():
+    """
+    Prepares the database for the API: the build step, run once from a single process before the API is started.
+
+    Switches the database to WAL mode, so requests keep reading while the summary tables are refreshed,
+    adds the DEP_HOUR column and the indexes, and (re)builds the summary tables.
+    """
+    # The journal mode can't be changed inside a transaction, so it is set on the plain DBAPI connection
+    dbapi_connection = maintenance_engine.raw_connection()
+    try:
+        dbapi_connection.cursor().execute("PRAGMA journal_mode=WAL")
+    finally:
+        dbapi_connection.close()
+    create_departure_hour_column()
+    create_indexes()
+    refresh_summary_tables()
+
+
+class TTLCache:
+    """
+    A thread-safe least-recently-used cache whose entries expire after a fixed time to live.
+
+    Attributes:
+        maxsize: Maximum number of entries kept; the least recently used entry is evicted first.
+        ttl: Number of seconds an entry stays valid.
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 300):
+        """
+        Initializes an empty cache.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached value for the key, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """
+        Stores a value under the key, evicting the least recently used entry if the cache is full.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes all entries from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+query_cache = TTLCache(maxsize=512, ttl=300)
+
+
+def cached_query(method):
+    """
+    Decorator caching the results of a FlightData query method, keyed by the method name and its arguments.
+
+    The database session is not part of the key, since every session reads the same data.
+    The modification time of the database file is, so the results cached by every worker process are
+    invalidated once refresh_summary_tables touches the file, not only those of the refreshing process.
+    Empty results are not cached, as _execute_query also returns an empty list on database errors.
+    """
+    @functools.wraps(method)
+    def wrapper(self, db_session, *args, **kwargs):
+        key = (os.stat(DATABASE_FILE).st_mtime_ns, method.__name__, args, tuple(sorted(kwargs.items())))
+        results = query_cache.get(key)
+        if results is None:
+            results = method(self, db_session, *args, **kwargs)
+            if results:
+                query_cache.set(key, results)
+        return results
+
+    return wrapper
+
+
+# Statements of the FlightData queries, built once at import instead of on every call
+FLIGHT_BY_ID_QUERY = text("""
+SELECT 
+    flights.ID AS FLIGHT_ID,
+    flights.ORIGIN_AIRPORT,
+    flights.DESTINATION_AIRPORT,
+    airlines.airline AS AIRLINE,
+    flights.DEPARTURE_DELAY AS DELAY
+FROM flights
+JOIN airlines ON flights.airline = airlines.id
+WHERE flights.ID = :id
+""")
+
+FLIGHTS_BY_DATE_QUERY = text("""
+SELECT 
+    flights.ID AS FLIGHT_ID,
+    flights.ORIGIN_AIRPORT,
+    flights.DESTINATION_AIRPORT,
+    airlines.airline AS AIRLINE,
+    flights.DEPARTURE_DELAY AS DELAY
+FROM flights
+JOIN airlines ON flights.airline = airlines.id
+WHERE flights.DAY = :day AND flights.MONTH = :month AND flights.YEAR = :year
+ORDER BY flights.ID
+Limit :limit OFFSET :offset
+""")
+
+AIRLINE_NAME_QUERY = text("SELECT 1 FROM airlines WHERE LOWER(airline) = LOWER(:airline)")
+
+DELAYED_FLIGHTS_BY_AIRLINE_QUERY = """
+SELECT 
+    flights.ID AS FLIGHT_ID,
+    flights.ORIGIN_AIRPORT,
+    flights.DESTINATION_AIRPORT,
+    airlines.airline AS AIRLINE,
+    flights.DEPARTURE_DELAY AS DELAY
+FROM flights
+JOIN airlines ON flights.airline = airlines.id
+WHERE {airline_filter}
+AND flights.DEPARTURE_DELAY > 20
+ORDER BY DEPARTURE_DELAY DESC, flights.ID
+Limit :limit OFFSET :offset
+"""
+# Full airline names are matched through the LOWER(airline) index, any other input as a part of the names
+DELAYED_FLIGHTS_BY_AIRLINE_NAME_QUERY = text(
+    DELAYED_FLIGHTS_BY_AIRLINE_QUERY.format(airline_filter="LOWER(airlines.airline) = LOWER(:airline)"))
+DELAYED_FLIGHTS_BY_AIRLINE_PATTERN_QUERY = text(
+    DELAYED_FLIGHTS_BY_AIRLINE_QUERY.format(airline_filter="airlines.airline LIKE :pattern"))
+
+# The matching codes are resolved in the small airports table first, so each one is an index seek
+# on (ORIGIN_AIRPORT, DEPARTURE_DELAY); CROSS JOIN keeps SQLite from driving the query by airline instead
+DELAYED_FLIGHTS_BY_AIRPORT_QUERY = text("""
+SELECT 
+    flights.ID AS FLIGHT_ID,
+    flights.ORIGIN_AIRPORT,
+    flights.DESTINATION_AIRPORT,
+    airlines.airline AS AIRLINE,
+    flights.DEPARTURE_DELAY AS DELAY
+FROM flights
+CROSS JOIN airlines ON flights.airline = airlines.id
+WHERE flights.ORIGIN_AIRPORT IN (SELECT IATA_CODE FROM airports WHERE IATA_CODE LIKE :airport)
+AND flights.DEPARTURE_DELAY > 20
+ORDER BY flights.DEPARTURE_DELAY DESC, flights.ID
+Limit :limit OFFSET :offset
+""")
+
+DELAYED_FLIGHTS_BY_HOUR_QUERY = text("""
+SELECT 
+    hour,
+    SUM(total_flights) AS total_flights,
+    SUM(delayed_flights) AS delayed_flights,
+    ROUND(SUM(departure_delay * total_flights) * 1.0 / SUM(total_flights), 2) AS average_departure_delay
+FROM mv_hour_delays
+WHERE departure_delay >= :threshold
+AND (:hour IS NULL OR hour = :hour)
+GROUP BY hour
+ORDER BY hour
+""")
+
+
 class FlightData:
     """
     A class that handles database queries related to flight data.
 
-    Attributes:
-        db_session: A database session object for executing queries.
+    The object holds no state; the database session of the request is passed to every query,
+    so the API shares a single FlightData object between all requests.
 
     Methods:
-        _execute_query(query: str, params: dict): Executes a query and returns the result as a list of dictionaries.
-        get_flight_by_id(flight_id: int): Returns flight details by ID.
-        get_flights_by_date(day: int, month: int, year: int): Returns flights for a specific date.
-        get_delayed_flights_by_airline(airline: str): Returns delayed flights for a specific airline.
-        get_delayed_flights_by_airport(airport: str): Returns delayed flights for a specific airport.
-        get_delayed_flights_by_hour(threshold: int): Returns delayed flights grouped by hour, with an optional threshold for delay.
+        _execute_query(db_session, query: TextClause, params: dict): Executes a query and returns the result as a list of dictionaries.
+        get_flight_by_id(db_session, flight_id: int): Returns flight details by ID.
+        get_flights_by_date(db_session, day: int, month: int, year: int): Returns flights for a specific date.
+        get_delayed_flights_by_airline(db_session, airline: str): Returns delayed flights for a specific airline.
+        get_delayed_flights_by_airport(db_session, airport: str): Returns delayed flights for a specific airport.
+        get_delayed_flights_by_hour(db_session, threshold: int): Returns delayed flights grouped by hour, with an optional threshold for delay.
     """
 
-    def __init__(self, db_session):
-        """
-        Initializes the FlightData object with a database session.
+    def _execute_query(self, db_session, query: TextClause, params: dict):
         """
-        self.db_session = db_session
+        Executes a query on the database and returns the result as a list of row mappings.
 
-    def _execute_query(self, query: str, params: dict):
-        """
-        Executes a query on the database and returns the result as a list of dictionaries.
+        The read-only mappings are returned as they are, without copying them into dictionaries;
+        the response models validate them like dictionaries.
 
         Args:
-            query: SQL query string.
+            db_session: The database session the query is executed in.
+            query: One of the prepared SQL statements above.
             params: Parameters to be passed with the query.
 
         Returns:
-            A list of dictionaries with query results.
+            A list of mappings (column name -> value) with query results.
         """
         try:
-            result = self.db_session.execute(text(query), params)
-            columns = result.keys()
-            result_dicts = [dict(zip(columns, row)) for row in result.fetchall()]
-            print(f"Columns: {columns}")
-            print(f"First 5 Results: {result_dicts[:5]}")  # Log the first few rows for debugging
-            return result_dicts
+            rows = db_session.execute(query, params).mappings().all()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("First 5 Results: %s", rows[:5])  # Log the first few rows for debugging
+            return rows
         except Exception as e:
-            print(f"Database error: {str(e)}")
+            logger.error("Database error: %s", e)
             return []
 
-    def get_flight_by_id(self, flight_id: int):
+    @cached_query
+    def get_flight_by_id(self, db_session, flight_id: int):
         """
         Fetches flight details by flight ID.
 
         Args:
+            db_session: The database session of the request.
             flight_id: The ID of the flight.
 
         Returns:
             A list of dictionaries containing flight data.
         """
         params = {'id': flight_id}
-        query = """
-        SELECT flights.*, airlines.airline, flights.ID as FLIGHT_ID, flights.DEPARTURE_DELAY as DELAY
-        FROM flights
-        JOIN airlines ON flights.airline = airlines.id
-        WHERE flights.ID = :id
-        """
-        return self._execute_query(query, params)
+        return self._execute_query(db_session, FLIGHT_BY_ID_QUERY, params)
 
-    def get_flights_by_date(self, day: int, month: int, year: int):
+    @cached_query
+    def get_flights_by_date(self, db_session, day: int, month: int, year: int, limit: int = 10, offset: int = 0):
         """
         Fetches flights for a specific date.
 
         Args:
+            db_session: The database session of the request.
             day: Day of the month.
             month: Month of the year.
             year: Year.
+            limit: Maximum number of flights returned.
+            offset: Number of flights skipped, for paging through the results.
 
         Returns:
             A list of dictionaries containing flight data.
         """
-        query = """
-        SELECT flights.*, airlines.airline, flights.ID as FLIGHT_ID, flights.DEPARTURE_DELAY as DELAY
-        FROM flights
-        JOIN airlines ON flights.airline = airlines.id
-        WHERE flights.DAY = :day AND flights.MONTH = :month AND flights.YEAR = :year
-        Limit 10
-        """
-        params = {'day': day, 'month': month, 'year': year}
-        return self._execute_query(query, params)
+        params = {'day': day, 'month': month, 'year': year, 'limit': limit, 'offset': offset}
+        return self._execute_query(db_session, FLIGHTS_BY_DATE_QUERY, params)
 
-    def get_delayed_flights_by_airline(self, airline: str):
+    @cached_query
+    def get_delayed_flights_by_airline(self, db_session, airline: str, limit: int = 10, offset: int = 0):
         """
         Fetches delayed flights for a specific airline.
 
+        A full airline name is matched exactly (case-insensitive, through the LOWER(airline) index),
+        any other input as a part of the airline names.
+
         Args:
+            db_session: The database session of the request.
             airline: The name of the airline.
+            limit: Maximum number of flights returned.
+            offset: Number of flights skipped, for paging through the results.
 
         Returns:
             A list of dictionaries containing delayed flight data.
         """
-        params = {'airline': f"%{airline}%"}
-        query = """
-        SELECT flights.*, airlines.airline, flights.ID as FLIGHT_ID, flights.DEPARTURE_DELAY as DELAY
-        FROM flights
-        JOIN airlines ON flights.airline = airlines.id
-        WHERE airlines.airline LIKE :airline
-        AND flights.DEPARTURE_DELAY > 20
-        ORDER BY DEPARTURE_DELAY DESC
-        Limit 10
-        """
-        return self._execute_query(query, params)
-
-    def get_delayed_flights_by_airport(self, airport: str):
+        params = {'airline': airline, 'limit': limit, 'offset': offset}
+        if self._execute_query(db_session, AIRLINE_NAME_QUERY, params):
+            return self._execute_query(db_session, DELAYED_FLIGHTS_BY_AIRLINE_NAME_QUERY, params)
+        params['pattern'] = f"%{airline}%"
+        return self._execute_query(db_session, DELAYED_FLIGHTS_BY_AIRLINE_PATTERN_QUERY, params)
+
+    @cached_query
+    def get_delayed_flights_by_airport(self, db_session, airport: str, limit: int = 10, offset: int = 0):
         """
         Fetches delayed flights for a specific airport.
 
         Args:
+            db_session: The database session of the request.
             airport: The airport code (e.g., "JFK").
+            limit: Maximum number of flights returned.
+            offset: Number of flights skipped, for paging through the results.
 
         Returns:
-            A list of dictionaries containing delayed flight data.
-        """
-        params = {'airport': f"%{airport}%"}
-        query = """
-        SELECT flights.*, airlines.airline, flights.ID as FLIGHT_ID, flights.DEPARTURE_DELAY as DELAY
-        FROM flights
-        JOIN airlines ON flights.airline = airlines.id
-        WHERE flights.ORIGIN_AIRPORT LIKE :airport
-        AND flights.DEPARTURE_DELAY > 20
-        Limit 10
+            A list of dictionaries containing delayed flight data, longest delays first.
         """
-        return self._execute_query(query, params)
+        params = {'airport': f"%{airport}%", 'limit': limit, 'offset': offset}
+        return self._execute_query(db_session, DELAYED_FLIGHTS_BY_AIRPORT_QUERY, params)
 
-    def get_delayed_flights_by_hour(self, threshold: int):
+    @cached_query
+    def get_delayed_flights_by_hour(self, db_session, threshold: int, hour: Optional[int] = None):
         """
         Fetches delayed flights grouped by hour.
 
         Args:
+            db_session: The database session of the request.
             threshold: Minimum departure delay to consider as "delayed."
+            hour: Only return the group of this hour of the day (optional).
 
         Returns:
             A list of dictionaries containing delayed flight data, grouped by hour.
         """
-        query = """
-        SELECT 
-            CAST(substr(flights.scheduled_departure, 1, 2) AS INTEGER) AS hour,
-            COUNT(flights.id) AS total_flights,
-            SUM(CASE WHEN flights.departure_delay > 20 THEN 1 ELSE 0 END) AS delayed_flights,
-            ROUND(AVG(flights.departure_delay), 2) AS average_departure_delay
-        FROM flights
-        WHERE flights.departure_delay >= :threshold
-        GROUP BY hour
-        ORDER BY hour
-        Limit 10
-        """
-        return self._execute_query(query, {"threshold": threshold})
-
-
-# Function to plot the delays by airline and save as a PNG image
-def plot_delays_by_airline(file_path: str):
-    """
-    Generates a bar plot for the percentage of delayed flights per airline and saves it as a PNG image.
-
-    Args:
-        file_path: The path where the image will be saved.
-    """
-    query = """
-    SELECT 
-        airlines.airline AS AIRLINE, 
-        COUNT(flights.id) AS total_flights,
-        SUM(CASE WHEN flights.departure_delay > 20 THEN 1 ELSE 0 END) AS delayed_flights
-    FROM flights
-    JOIN airlines ON flights.airline = airlines.id
-    GROUP BY airlines.airline
-    """
-    df = pd.read_sql(query, engine)
-    df['percent_delayed'] = (df['delayed_flights'] / df['total_flights']) * 100
-
-    plt.figure(figsize=(12,6))
-    sns.barplot(x='AIRLINE', y='percent_delayed', data=df)
-    plt.xticks(rotation=45, ha='right')
-    plt.ylabel('Percentage of Delayed Flights')
-    plt.title('Percentage of Delayed Flights by Airline')
-    plt.tight_layout()
-
-    # Save the figure to a PNG image
-    plt.savefig(file_path, format="png")
-    plt.close()
-
-
-# Function to plot the delays by hour and save as a PNG image
-def plot_delays_by_hour(file_path: str):
-    """
-    Generates a bar plot for the percentage of delayed flights by hour and saves it as a PNG image.
-
-    Args:
-        file_path: The path where the image will be saved.
-    """
-    query = """
-    SELECT 
-        CAST(substr(flights.scheduled_departure, 1, 2) AS INTEGER) AS hour,
-        COUNT(flights.id) AS total_flights,
-        SUM(CASE WHEN flights.departure_delay > 20 THEN 1 ELSE 0 END) AS delayed_flights
-    FROM flights
-    GROUP BY hour
-    ORDER BY hour
-    """
-    df = pd.read_sql(query, engine)
-    df['percent_delayed'] = (df['delayed_flights'] / df['total_flights']) * 100
-
-    plt.figure(figsize=(12,6))
-    sns.barplot(x='hour', y='percent_delayed', data=df, palette="YlGnBu")
-    plt.ylabel('Percentage of Delayed Flights')
-    plt.xlabel('Hour of Day')
-    plt.title('Percentage of Delayed Flights by Hour of Day')
-    plt.xticks(range(24))  # Hours from 0 to 23
-    plt.tight_layout()
-
-    # Save the figure to a PNG image
-    plt.savefig(file_path, format="png")
-    plt.close()
-
-
-# Function to plot the heatmap of routes and save as a PNG image
-def plot_heatmap_of_routes(file_path: str):
-    """
-    Generates a heatmap for delayed flights by route (origin → destination) and saves it as a PNG image.
-
-    Args:
-        file_path: The path where the image will be saved.
-    """
-    query = """
-    SELECT 
-        flights.origin_airport AS origin,
-        flights.destination_airport AS destination,
-        COUNT(flights.id) AS total_flights,
-        SUM(CASE WHEN flights.departure_delay > 20 THEN 1 ELSE 0 END) AS delayed_flights
-    FROM flights
-    GROUP BY origin, destination
-    """
-    df = pd.read_sql(query, engine)
-    df['percent_delayed'] = (df['delayed_flights'] / df['total_flights']) * 100
-    pivot_df = df.pivot(index='origin', columns='destination', values='percent_delayed')
-
-    plt.figure(figsize=(9,8))
-    sns.heatmap(pivot_df, cmap="Reds", linewidths=0.5)
-    plt.title('Heatmap: % Delayed Flights by Route (Origin → Destination)')
-    plt.ylabel('Origin Airport')
-    plt.xlabel('Destination Airport')
-    plt.tight_layout()
-
-    # Save the figure to a PNG image
-    plt.savefig(file_path, format="png")
-    plt.close()
-
-
-# Function to plot the map of routes and save as an HTML file
-def plot_map_of_routes(file_path: str):
-    """
-    Generates and saves an interactive map of delayed flight routes across the USA.
-
-    Args:
-        file_path: The path where the HTML map will be saved.
-    """
-    query = """
-    SELECT 
-        flights.origin_airport AS origin,
-        flights.destination_airport AS destination,
-        COUNT(flights.id) AS total_flights,
-        SUM(CASE WHEN flights.departure_delay > 20 THEN 1 ELSE 0 END) AS delayed_flights
-    FROM flights
-    GROUP BY origin, destination
-    """
-
-    df_routes = pd.read_sql(query, engine)
-    df_routes['percent_delayed'] = (df_routes['delayed_flights'] / df_routes['total_flights']) * 100
-
-    # Get airport coordinates
-    query_airports = """
-    SELECT IATA_CODE, LATITUDE, LONGITUDE
-    FROM airports
-    WHERE IATA_CODE IS NOT NULL
-    """
-    df_airports = pd.read_sql(query_airports, engine)
-    airport_coords = df_airports.set_index('IATA_CODE')[['LATITUDE', 'LONGITUDE']].to_dict('index')
-
-    # Create the base map
-    flight_map = folium.Map(location=[39.8283, -98.5795], zoom_start=4)  # Center of USA
-
-    # Draw routes
-    for idx, row in df_routes.iterrows():
-        origin = row['origin']
-        dest = row['destination']
-        delay_percent = row['percent_delayed']
-
-        if origin not in airport_coords or dest not in airport_coords:
-            continue  # Skip if coordinates are missing
-
-        # Only show routes with delayed flights over 30%
-        if delay_percent <= 30:
-            continue  # Skip routes with low delay
-
-        origin_coords = (float(airport_coords[origin]['LATITUDE']), float(airport_coords[origin]['LONGITUDE']))
-        dest_coords = (float(airport_coords[dest]['LATITUDE']), float(airport_coords[dest]['LONGITUDE']))
-
-        # Color logic (routes with higher delay are in red, lower in orange)
-        color = 'red' if delay_percent > 50 else 'orange'
-
-        folium.PolyLine(
-            locations=[origin_coords, dest_coords],
-            color=color,
-            weight=1 + delay_percent / 40,  # Thicker for worse delay
-            opacity=0.5,
-            tooltip=f"{origin} → {dest}: {delay_percent:.1f}% delayed"
-        ).add_to(flight_map)
+        params = {"threshold": threshold, "hour": hour}
+        return self._execute_query(db_session, DELAYED_FLIGHTS_BY_HOUR_QUERY, params)
 
-    # Save the map as an HTML file
-    flight_map.save(file_path)
 
+if __name__ == "__main__":
+    # Build step: prepare the derived column, indexes and summary tables ahead of deployment
+    logging.basicConfig(level=logging.INFO)
+    build_database()
+    logger.info("Database %s prepared.", DATABASE_FILE)
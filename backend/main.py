@@ -1,27 +1,83 @@
 import data
 import visualization
 from sqlalchemy.orm import Session
-from datetime import datetime
 from pydantic import BaseModel
 from typing import Optional, List, Dict
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Header, Query, Request, Response
 from fastapi.responses import FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-import io
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import asyncio
+import datetime
+import logging
+import orjson
 import os
+import re
+import secrets
 
 STATIC_FOLDER = "static/graphs"
 os.makedirs(STATIC_FOLDER, exist_ok=True)
 
+logger = logging.getLogger(__name__)
+
+# Plots are rendered in worker processes, so matplotlib neither blocks the event loop nor each other
+plot_pool = ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=visualization.init_plot_worker)
+# Renders in progress by file path, so concurrent requests for the same plot wait on the same render
+pending_renders = {}
+
+# Generated graphs and maps are overwritten in place, so browsers keep them but revalidate with the ETag (304)
+PLOT_CACHE_CONTROL = "public, no-cache"
+# Versioned plot URLs (?v=<mtime>) change whenever a plot is regenerated, so browsers can keep them without revalidating
+VERSIONED_PLOT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    Static files served with a Cache-Control header, on top of the ETag/Last-Modified headers of StaticFiles.
+    Only URLs versioned with the file's current mtime (see plot_url) are cached as immutable; a stale or made-up
+    version falls back to revalidation, so it can't pin an old or different file in the browser cache.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        versioned = Request(scope).query_params.get("v") == str(stat_result.st_mtime_ns)
+        response.headers["Cache-Control"] = VERSIONED_PLOT_CACHE_CONTROL if versioned else PLOT_CACHE_CONTROL
+        return response
+
+
+class RowsJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson, which also serializes the row mappings returned by data.FlightData.
+    The flight rows come straight from SQL, so the list endpoints return them through this response as they are,
+    without validating them per row against FlightSearchResponse (which only documents their schema).
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=dict, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+class PlotAwareGZipMiddleware(GZipMiddleware):
+    """
+    GZip middleware that leaves the generated PNG graphs alone; they are compressed already, and the pinned
+    Starlette only excludes text/event-stream responses from compression.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/static/graphs/"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
 
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(default_response_class=RowsJSONResponse)
 
 # Mount static directories for graphs and maps
-app.mount("/static/graphs", StaticFiles(directory="static/graphs"), name="graphs")
-app.mount("/static/maps", StaticFiles(directory="static/maps"), name="maps")
+app.mount("/static/graphs", CachedStaticFiles(directory="static/graphs"), name="graphs")
+app.mount("/static/maps", CachedStaticFiles(directory="static/maps"), name="maps")
 
 # Add CORS middleware to allow cross-origin requests (useful when frontend and backend are on different origins)
 app.add_middleware(
@@ -32,12 +88,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress larger responses (flight lists, route GeoJSON) for clients that accept gzip, except the PNG graphs
+app.add_middleware(PlotAwareGZipMiddleware, minimum_size=500)
+
 # Folder to save images
 STATIC_FOLDER = "static/graphs"
 os.makedirs(STATIC_FOLDER, exist_ok=True)
 
-SQLITE_URI = 'sqlite:///flights.sqlite3'  # Using the correct SQLite URI
+# Leaflet map page and the route data it loads from /static/maps/routes.geojson
+MAP_FILE = "static/maps/map.html"
+ROUTES_FILE = "static/maps/routes.geojson"
+
 IATA_LENGTH = 3
+DATE_PATTERN = re.compile(r"(\d{1,2})/(\d{1,2})/(\d{4})")  # DD/MM/YYYY
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 1000
+
+# Token expected in the X-Admin-Token header of the admin endpoints; they are disabled while it isn't configured
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Flight data queries, shared by all requests; each call gets the request's database session
+flight_data = data.FlightData()
 
 
 # Pydantic response model for flight data
@@ -49,6 +120,14 @@ class FlightSearchResponse(BaseModel):
     DELAY: Optional[int] = 0
 
 
+# Pydantic response model for the delayed flights grouped by hour
+class HourDelay(BaseModel):
+    hour: int
+    total_flights: int
+    delayed_flights: int
+    average_departure_delay: float
+
+
 @app.get("/", response_model=Dict[str, Dict[str, str]])
 def home():
     """
@@ -70,6 +149,23 @@ def home():
     }
 
 
+@app.on_event("startup")
+def check_database():
+    """
+    Checks that the database was prepared by the build step (python data.py) before the API starts serving requests.
+    Startup only reads the database, so several workers can start at once.
+    """
+    data.check_database()
+
+
+@app.on_event("shutdown")
+def shutdown_plot_pool():
+    """
+    Stops the plot worker processes when the API shuts down.
+    """
+    plot_pool.shutdown(wait=False, cancel_futures=True)
+
+
 def get_db():
     """
     Dependency to get the database session.
@@ -77,11 +173,7 @@ def get_db():
     Returns:
         A database session object.
     """
-    from sqlalchemy import create_engine
-    from sqlalchemy.orm import sessionmaker
-    engine = create_engine(SQLITE_URI, echo=True)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    db_session = SessionLocal()
+    db_session = data.SessionLocal()
     try:
         yield db_session
     finally:
@@ -100,8 +192,7 @@ def flight_by_id(flight_id: int, db: Session = Depends(get_db)):
         Flight details as a response.
     """
     try:
-        data_manager = data.FlightData(db)
-        results = data_manager.get_flight_by_id(flight_id)
+        results = flight_data.get_flight_by_id(db, flight_id)
         if not results:
             raise HTTPException(status_code=404, detail="Flight not found")
         return results[0]
@@ -109,34 +200,39 @@ def flight_by_id(flight_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
 
-@app.get("/delays_by_airline", response_model=List[FlightSearchResponse])
-def delays_by_airline(airline: str, db: Session = Depends(get_db)):
+@app.get("/delays_by_airline", responses={200: {"model": List[FlightSearchResponse]}})
+def delays_by_airline(airline: str, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                      offset: int = Query(0, ge=0), db: Session = Depends(get_db)):
     """
     Fetches delayed flights by airline.
 
     Args:
         airline: The name of the airline.
+        limit: Maximum number of flights returned (at most MAX_PAGE_SIZE).
+        offset: Number of flights skipped, for paging through the results.
 
     Returns:
         A list of delayed flight details for the specified airline.
     """
     try:
-        data_manager = data.FlightData(db)
-        results = data_manager.get_delayed_flights_by_airline(airline)
+        results = flight_data.get_delayed_flights_by_airline(db, airline, limit, offset)
         if not results:
             return []  # Return an empty list if no results found
-        return results
+        return RowsJSONResponse(results)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
 
-@app.get("/delays_by_airport", response_model=List[FlightSearchResponse])
-def delays_by_airport(airport_code: str, db: Session = Depends(get_db)):
+@app.get("/delays_by_airport", responses={200: {"model": List[FlightSearchResponse]}})
+def delays_by_airport(airport_code: str, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                      offset: int = Query(0, ge=0), db: Session = Depends(get_db)):
     """
     Fetches delayed flights by airport code (IATA).
 
     Args:
         airport_code: The IATA code of the airport.
+        limit: Maximum number of flights returned (at most MAX_PAGE_SIZE).
+        offset: Number of flights skipped, for paging through the results.
 
     Returns:
         A list of delayed flight details for the specified airport.
@@ -144,125 +240,148 @@ def delays_by_airport(airport_code: str, db: Session = Depends(get_db)):
     if len(airport_code) != IATA_LENGTH or not airport_code.isalpha():
         raise HTTPException(status_code=400, detail="Invalid IATA code. Please provide a valid 3-letter airport code.")
 
-    data_manager = data.FlightData(db)
-    results = data_manager.get_delayed_flights_by_airport(airport_code)
-    return results
+    results = flight_data.get_delayed_flights_by_airport(db, airport_code, limit, offset)
+    return RowsJSONResponse(results)
 
 
-@app.get("/flights_by_date", response_model=List[FlightSearchResponse])
-def flights_by_date(date: str, db: Session = Depends(get_db)):
+@app.get("/flights_by_date", responses={200: {"model": List[FlightSearchResponse]}})
+def flights_by_date(date: str, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                    offset: int = Query(0, ge=0), db: Session = Depends(get_db)):
     """
     Fetches flights by a specific date.
 
     Args:
         date: The date to fetch flights for, in the format 'DD/MM/YYYY'.
+        limit: Maximum number of flights returned (at most MAX_PAGE_SIZE).
+        offset: Number of flights skipped, for paging through the results.
 
     Returns:
         A list of flight details for the specified date.
     """
+    match = DATE_PATTERN.fullmatch(date)
+    if not match:
+        raise HTTPException(status_code=400, detail="Invalid date format. Please provide a date in DD/MM/YYYY format.")
+    day, month, year = map(int, match.groups())
     try:
-        date_input = datetime.strptime(date, '%d/%m/%Y')
+        # Rejects impossible dates such as 31/02/2015, not just out of range days and months
+        datetime.date(year, month, day)
     except ValueError:
-        return {"error": "Invalid date format. Please provide a date in DD/MM/YYYY format."}
+        raise HTTPException(status_code=400,
+                            detail="Invalid date format. Please provide a date in DD/MM/YYYY format.") from None
 
-    data_manager = data.FlightData(db)
-    results = data_manager.get_flights_by_date(date_input.day, date_input.month, date_input.year)
-    return results
+    results = flight_data.get_flights_by_date(db, day, month, year, limit, offset)
+    return RowsJSONResponse(results)
 
 
-@app.get("/delayed_flights_by_hour", response_model=List[Dict[str, float]])
-def delayed_flights_by_hour(hour: Optional[int] = None, threshold: Optional[int] = 20, db: Session = Depends(get_db)):
+@app.get("/delayed_flights_by_hour", response_model=List[HourDelay])
+def delayed_flights_by_hour(hour: Optional[int] = Query(None, ge=0, le=23), threshold: int = 20,
+                            db: Session = Depends(get_db)):
     """
     Fetches the percentage of delayed flights by hour, with an optional threshold for delays.
 
     Args:
-        hour: The hour to filter by (optional).
+        hour: The hour (0-23) to filter by (optional).
         threshold: The minimum delay threshold to filter by (default is 20 minutes).
 
     Returns:
         A list of delayed flights by hour, optionally filtered by hour and delay threshold.
     """
     try:
-        data_manager = data.FlightData(db)
-        results = data_manager.get_delayed_flights_by_hour(threshold)
+        results = flight_data.get_delayed_flights_by_hour(db, threshold, hour)
         if not results:
             return []
-
-        # Optional filtering based on hour
-        if hour is not None:
-            results = [r for r in results if r['hour'] == hour]
-
         return results
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.error("Error: %s", e)
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
 
-def generate_plot_for_delay_by_hours(file_path: str):
+def is_plot_current(file_path: str) -> bool:
     """
-    Generates a plot and saves it as a PNG file at the specified path.
+    Checks whether a generated plot file exists and is newer than the database it was built from.
 
     Args:
-        file_path: The path where the generated plot will be saved.
+        file_path: The path of the generated plot file.
+
+    Returns:
+        True if the file can be served as is, False if it has to be (re)generated.
     """
-    # Generate the plot (your plotting function)
-    fig = visualization.plot_delays_by_hour()  # Assuming this returns a matplotlib figure
+    return os.path.exists(file_path) and os.path.getmtime(file_path) > os.path.getmtime(data.DATABASE_FILE)
 
-    # Convert plot to bytes
-    buf = io.BytesIO()
-    canvas = FigureCanvas(fig)
-    canvas.print_png(buf)
-    buf.seek(0)
 
-    # Save the plot as a file in the static directory
-    with open(file_path, 'wb') as f:
-        f.write(buf.read())
+def plot_url(file_path: str) -> str:
+    """
+    Returns the static URL of a generated plot, versioned with the modification time of the file.
+
+    Args:
+        file_path: The path of the generated plot file.
+
+    Returns:
+        The URL, which changes whenever the plot is regenerated.
+    """
+    return f"/{file_path}?v={os.stat(file_path).st_mtime_ns}"
+
+
+async def render_plot(render_function, file_path: str):
+    """
+    Runs a render function in the plot process pool and waits until the file is written.
+
+    Concurrent calls for the same file share a single render.
+
+    Args:
+        render_function: A picklable function taking the file path and writing the plot to it.
+        file_path: The path where the generated plot will be saved.
+    """
+    future = pending_renders.get(file_path)
+    if future is None:
+        future = asyncio.get_running_loop().run_in_executor(plot_pool, render_function, file_path)
+        pending_renders[file_path] = future
+        future.add_done_callback(lambda _: pending_renders.pop(file_path, None))
+    # Shielded, so a cancelled request doesn't cancel the render other requests are waiting for
+    await asyncio.shield(future)
 
 
 @app.get("/show_bar_graph", responses={200: {"content": {"image/png": {}}}})
-def show_bar_graph():
+async def show_bar_graph(refresh: bool = False):
     """
     Generates and returns the bar graph for percentage of delayed flights per airline as a PNG image.
     The image is also saved to the static folder for later access.
-    """
-    # Create the graph in memory
-    fig = visualization.plot_delays_by_airline()
 
-    # Convert the plot to bytes in memory
-    buf = io.BytesIO()
-    canvas = FigureCanvas(fig)
-    canvas.print_png(buf)
-    buf.seek(0)  # Move to the start of the BytesIO buffer
-
-    # Save the image to static folder
+    Args:
+        refresh: Regenerate the graph even if an up-to-date image already exists.
+    """
     file_path = os.path.join(STATIC_FOLDER, "bar_graph.png")
-    with open(file_path, "wb") as f:
-        f.write(buf.read())
+    if refresh or not is_plot_current(file_path):
+        # Render the graph and save the image to static folder
+        await render_plot(partial(visualization.save_figure, visualization.plot_delays_by_airline), file_path)
 
     # Return a message with image and confirmation
     return JSONResponse(content={
         "message": "Graph 'bar_graph.png' has been successfully generated and saved in the static folder.",
-        "image_url": f"/static/graphs/bar_graph.png"
+        "image_url": plot_url(file_path)
     })
 
 
 
 @app.get("/show_hourly_bar_graph")
-async def show_hourly_bar_graph(background_tasks: BackgroundTasks):
+async def show_hourly_bar_graph(background_tasks: BackgroundTasks, refresh: bool = False):
     """
     Initiates graph generation in the background for hourly delays.
     Returns a response indicating the task is in progress.
 
     Args:
         background_tasks: A background task object to execute the task asynchronously.
+        refresh: Regenerate the graph even if an up-to-date image already exists.
 
     Returns:
         A message indicating the graph generation is in progress.
     """
     file_path = os.path.join(STATIC_FOLDER, "hourly_bar_graph.png")
 
-    # Add the task to generate the graph in the background
-    background_tasks.add_task(generate_plot_for_delay_by_hours, file_path)
+    # Add the task to generate the graph in the background (skipped if the saved graph is still current)
+    if refresh or not is_plot_current(file_path):
+        background_tasks.add_task(
+            render_plot, partial(visualization.save_figure, visualization.plot_delays_by_hour), file_path)
 
     # Return a response indicating that the graph generation is in progress
     return {"message": "Graph is generated in the background and successfully saved in the static folder.",
@@ -270,43 +389,81 @@ async def show_hourly_bar_graph(background_tasks: BackgroundTasks):
 
 
 @app.get("/show_heatmap_of_routes", responses={200: {"content": {"image/png": {}}}})
-def show_heatmap_of_routes():
+async def show_heatmap_of_routes(refresh: bool = False):
     """
     Generates and returns a heatmap showing the percentage of delayed flights distributed across flight routes as a PNG image.
     The image is also saved to the static folder for later access.
-    """
-    # Create the heatmap in memory
-    fig = visualization.plot_heatmap_of_routes()
-
-    # Convert the plot to bytes in memory
-    buf = io.BytesIO()
-    canvas = FigureCanvas(fig)
-    canvas.print_png(buf)
-    buf.seek(0)  # Move to the start of the BytesIO buffer
 
-    # Save the image to static folder
+    Args:
+        refresh: Regenerate the heatmap even if an up-to-date image already exists.
+    """
     file_path = os.path.join(STATIC_FOLDER, "heatmap_of_routes.png")
-    with open(file_path, "wb") as f:
-        f.write(buf.read())
+    if refresh or not is_plot_current(file_path):
+        # Render the heatmap and save the image to static folder
+        await render_plot(partial(visualization.save_figure, visualization.plot_heatmap_of_routes), file_path)
 
     # Return a message with image and confirmation
     return JSONResponse(content={
         "message": "Heatmap 'heatmap_of_routes.png' has been successfully generated and saved in the static folder.",
-        "image_url": f"/static/graphs/heatmap_of_routes.png"
+        "image_url": plot_url(file_path)
     })
 
 
 @app.get("/show_map_of_routes")
-def show_map_of_routes():
+async def show_map_of_routes(request: Request, refresh: bool = False):
     """
-    Generates and saves an interactive map showing major delayed routes across the USA.
-    The map is saved as an HTML file in the static folder.
+    Generates and saves the data of an interactive map showing major delayed routes across the USA.
+    The routes are saved as a GeoJSON file in the static folder and drawn in the browser by the returned map page.
+
+    Args:
+        request: The incoming request, checked for a matching If-None-Match header.
+        refresh: Regenerate the routes even if an up-to-date file already exists.
+    """
+    if refresh or not is_plot_current(ROUTES_FILE):
+        await render_plot(visualization.plot_map_of_routes, ROUTES_FILE)
+
+    # Return the map page, with the proper MIME type for HTML files
+    response = FileResponse(MAP_FILE, media_type="text/html", stat_result=os.stat(MAP_FILE),
+                            headers={"Cache-Control": PLOT_CACHE_CONTROL})
+
+    # The browser already has this version of the map
+    if_none_match = request.headers.get("if-none-match", "")
+    if response.headers["etag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": response.headers["etag"],
+                                                  "Cache-Control": PLOT_CACHE_CONTROL})
+    return response
+
+
+def require_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """
+    Dependency guarding the admin endpoints with the configured ADMIN_TOKEN.
+
+    Args:
+        x_admin_token: The token sent in the X-Admin-Token header.
     """
-    file_path = "static/maps/map_of_routes.html"
-    visualization.plot_map_of_routes(file_path)
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@app.post("/admin/refresh_views", dependencies=[Depends(require_admin_token)])
+def refresh_views():
+    """
+    Rebuilds the summary tables behind the plots and the hourly endpoint, e.g. after new flights were loaded.
+    Cached query results are dropped in every worker process and the plots are regenerated on their next request.
+    Only available with the X-Admin-Token header, when ADMIN_TOKEN is configured.
+
+    Returns:
+        A confirmation message.
+    """
+    try:
+        data.refresh_summary_tables()
+    except Exception as e:
+        logger.error("Error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
-    # Return the file as a response, but the proper MIME type for HTML files
-    return FileResponse(file_path, media_type="text/html")
+    return {"message": "Summary tables have been rebuilt."}
 
 
 
@@ -0,0 +1,109 @@
+import os
+import shutil
+import sys
+import threading
+
+import pytest
+from sqlalchemy import text
+
+BACKEND_FOLDER = os.path.dirname(os.path.abspath(__file__))
+DATABASE_FILE = os.path.join(BACKEND_FOLDER, "flights.sqlite3")
+STATIC_FOLDER = os.path.join(BACKEND_FOLDER, "static")
+
+
+@pytest.fixture
+def data(tmp_path, monkeypatch):
+    """
+    Imports the data module against a prepared copy of the database, so the tracked database stays untouched.
+    """
+    shutil.copy(DATABASE_FILE, tmp_path / "flights.sqlite3")
+    monkeypatch.chdir(tmp_path)  # The database URL is relative to the working directory
+    sys.modules.pop("data", None)
+    import data
+    data.build_database()
+    yield data
+    data.engine.dispose()
+    sys.modules.pop("data", None)
+
+
+@pytest.fixture
+def main(data, tmp_path):
+    """
+    Imports the API against the prepared database copy, next to a copy of the static folder.
+    """
+    shutil.copytree(STATIC_FOLDER, tmp_path / "static")
+    sys.modules.pop("visualization", None)
+    sys.modules.pop("main", None)
+    import main
+    yield main
+    main.plot_pool.shutdown(cancel_futures=True)
+    sys.modules.pop("main", None)
+    sys.modules.pop("visualization", None)
+
+
+@pytest.fixture
+def client(main):
+    """
+    Returns a test client for the API.
+    """
+    from fastapi.testclient import TestClient
+    return TestClient(main.app)
+
+
+def test_summary_tables_stay_readable_during_refresh(data):
+    counts = []
+    refresh = threading.Thread(target=data.refresh_summary_tables)
+    refresh.start()
+    while refresh.is_alive():
+        with data.engine.connect() as connection:
+            counts.append(connection.execute(text("SELECT COUNT(*) FROM mv_hour_delays")).scalar())
+    refresh.join()
+
+    assert len(counts) > 1  # Queries ran while the rebuild was in progress
+    assert all(count > 0 for count in counts)
+
+
+def test_refresh_fills_in_the_hour_of_new_flights(data):
+    with data.maintenance_engine.begin() as connection:
+        connection.execute(text("""
+        INSERT INTO flights (YEAR, MONTH, DAY, AIRLINE, ORIGIN_AIRPORT, DESTINATION_AIRPORT,
+                             SCHEDULED_DEPARTURE, DEPARTURE_DELAY)
+        SELECT YEAR, MONTH, DAY, AIRLINE, ORIGIN_AIRPORT, DESTINATION_AIRPORT, '0545', 30
+        FROM flights LIMIT 1
+        """))
+    data.refresh_summary_tables()
+
+    with data.engine.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM flights WHERE DEP_HOUR IS NULL")).scalar() == 0
+        assert connection.execute(text("SELECT COUNT(*) FROM mv_hour_delays WHERE hour IS NULL")).scalar() == 0
+
+
+def test_refresh_views_is_disabled_without_admin_token(main, client, monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", None)
+    assert client.post("/admin/refresh_views", headers={"X-Admin-Token": "secret"}).status_code == 404
+
+
+def test_refresh_views_rejects_wrong_admin_token(main, client, monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    assert client.post("/admin/refresh_views").status_code == 403
+    assert client.post("/admin/refresh_views", headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+
+def test_refresh_views_accepts_admin_token(main, client, monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    response = client.post("/admin/refresh_views", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.json() == {"message": "Summary tables have been rebuilt."}
+
+
+def test_plot_url_is_cached_as_immutable(main, client):
+    url = main.plot_url(os.path.join(main.STATIC_FOLDER, "bar_graph.png"))
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+
+
+def test_stale_plot_version_is_revalidated(client):
+    response = client.get("/static/graphs/bar_graph.png?v=1")
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "public, no-cache"
@@ -1,12 +1,86 @@
 import matplotlib
 
 matplotlib.use('Agg')  # Use the Agg backend for non-interactive plotting
-import pandas as pd
-import seaborn as sns
+import numpy as np
 import matplotlib.pyplot as plt
-import folium
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import json
+import logging
 import os
-from sqlalchemy import create_engine
+import tempfile
+import threading
+from contextlib import contextmanager
+from sqlalchemy import text
+from data import engine
+
+logger = logging.getLogger(__name__)
+
+
+# Figures of this process, reused for every render of the same plot: clearing a figure is cheaper than building a new one.
+# matplotlib isn't thread-safe, so a figure is only drawn and saved while holding the lock (see save_figure).
+_figures = {}
+_figures_lock = threading.Lock()
+
+# The process umask, applied to the plot files like open() does; os.umask can only be read by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _reusable_figure(name: str, figsize: tuple):
+    """
+    Returns the cleared figure kept for a plot, creating it on first use.
+
+    Args:
+        name: The name of the plot the figure is kept for.
+        figsize: The size of the figure in inches, used when it is created.
+
+    Returns:
+        matplotlib.figure.Figure: An empty figure.
+    """
+    fig = _figures.get(name)
+    if fig is None:
+        fig = _figures[name] = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+    fig.clear()
+    return fig
+
+
+@contextmanager
+def _atomic_write(file_path: str, mode: str = "wb"):
+    """
+    Opens a temporary file next to file_path and moves it onto file_path once it was written completely.
+
+    Readers (and the freshness check of the API) never see a half-written file; if writing fails,
+    the temporary file is removed and an existing file at file_path is left untouched.
+    The temporary file is created private (0600), so it gets the permissions of a file written with open()
+    before it is moved into place, and the static files stay readable for other users (e.g. a web server).
+
+    Args:
+        file_path: The path the file is finally saved under.
+        mode: The mode the temporary file is opened with.
+    """
+    directory = os.path.dirname(file_path) or "."
+    with tempfile.NamedTemporaryFile(mode, dir=directory, suffix=".tmp", delete=False) as f:
+        temp_path = f.name
+        try:
+            yield f
+        except BaseException:
+            f.close()
+            os.remove(temp_path)
+            raise
+    os.chmod(temp_path, 0o666 & ~_UMASK)
+    os.replace(temp_path, file_path)
+
+
+def init_plot_worker():
+    """
+    Prepares a worker process of the API's plot pool for using the shared engine.
+
+    Forked workers inherit the pooled connections of the parent process; they are dropped here
+    without closing them, so each worker opens its own SQLite connections.
+    """
+    engine.dispose(close=False)
 
 
 # Function to plot the delays by airline and return the figure
@@ -19,25 +93,23 @@ def plot_delays_by_airline():
     Returns:
         fig (matplotlib.figure.Figure): The generated bar plot figure.
     """
-    engine = create_engine('sqlite:///flights.sqlite3')
     query = """
-    SELECT 
-        airlines.airline AS AIRLINE, 
-        COUNT(flights.id) AS total_flights,
-        SUM(CASE WHEN flights.departure_delay > 20 THEN 1 ELSE 0 END) AS delayed_flights
-    FROM flights
-    JOIN airlines ON flights.airline = airlines.id
-    GROUP BY airlines.airline
-    """
-    df = pd.read_sql(query, engine)
-    df['percent_delayed'] = (df['delayed_flights'] / df['total_flights']) * 100
-
-    fig = plt.figure(figsize=(12, 6))
-    sns.barplot(x='AIRLINE', y='percent_delayed', data=df)
-    plt.xticks(rotation=45, ha='right')
-    plt.ylabel('Percentage of Delayed Flights')
-    plt.title('Percentage of Delayed Flights by Airline')
-    plt.tight_layout()
+    SELECT airline AS AIRLINE, 100.0 * delayed_flights / total_flights AS percent_delayed
+    FROM mv_airline_delays
+    ORDER BY airline
+    """
+    with engine.connect() as connection:
+        rows = connection.execute(text(query)).all()
+    airlines, percent_delayed = zip(*rows)
+
+    fig = _reusable_figure("airline", figsize=(12, 6))
+    ax = fig.add_subplot()
+    ax.bar(airlines, percent_delayed)
+    ax.tick_params(axis='x', labelrotation=45)
+    plt.setp(ax.get_xticklabels(), ha='right')
+    ax.set_ylabel('Percentage of Delayed Flights')
+    ax.set_title('Percentage of Delayed Flights by Airline')
+    fig.tight_layout()
 
     return fig
 
@@ -52,26 +124,31 @@ def plot_delays_by_hour():
     Returns:
         fig (matplotlib.figure.Figure): The generated bar plot figure.
     """
-    engine = create_engine('sqlite:///flights.sqlite3')
     query = """
     SELECT 
-        CAST(substr(flights.scheduled_departure, 1, 2) AS INTEGER) AS hour,
-        COUNT(flights.id) AS total_flights,
-        SUM(CASE WHEN flights.departure_delay > 20 THEN 1 ELSE 0 END) AS delayed_flights
-    FROM flights
+        hour,
+        100.0 * SUM(delayed_flights) / SUM(total_flights) AS percent_delayed
+    FROM mv_hour_delays
     GROUP BY hour
     ORDER BY hour
     """
-    df = pd.read_sql(query, engine)
-    df['percent_delayed'] = (df['delayed_flights'] / df['total_flights']) * 100
-
-    fig = plt.figure(figsize=(12, 6))
-    sns.barplot(x='hour', y='percent_delayed', data=df, palette="YlGnBu")
-    plt.ylabel('Percentage of Delayed Flights')
-    plt.xlabel('Hour of Day')
-    plt.title('Percentage of Delayed Flights by Hour of Day')
-    plt.xticks(range(24))  # Hours from 0 to 23
-    plt.tight_layout()
+    with engine.connect() as connection:
+        rows = connection.execute(text(query)).all()
+    hours, percent_delayed = zip(*rows)
+    hours = np.asarray(hours, dtype=np.int8)
+
+    # Same sampling of the colormap as seaborn's "YlGnBu" palette
+    colors = matplotlib.colormaps['YlGnBu'](np.linspace(0, 1, len(hours) + 2)[1:-1])
+
+    fig = _reusable_figure("hour", figsize=(12, 6))
+    ax = fig.add_subplot()
+    ax.bar(hours, percent_delayed, color=colors)
+    ax.set_ylabel('Percentage of Delayed Flights')
+    ax.set_xlabel('Hour of Day')
+    ax.set_title('Percentage of Delayed Flights by Hour of Day')
+    ax.set_xticks(range(24))  # Hours from 0 to 23
+    ax.set_xlim(-0.5, 23.5)
+    fig.tight_layout()
 
     return fig
 
@@ -86,105 +163,109 @@ def plot_heatmap_of_routes():
     Returns:
         fig (matplotlib.figure.Figure): The generated heatmap figure.
     """
-    engine = create_engine('sqlite:///flights.sqlite3')
     query = """
-    SELECT 
-        flights.origin_airport AS origin,
-        flights.destination_airport AS destination,
-        COUNT(flights.id) AS total_flights,
-        SUM(CASE WHEN flights.departure_delay > 20 THEN 1 ELSE 0 END) AS delayed_flights
-    FROM flights
-    GROUP BY origin, destination
-    """
-    df = pd.read_sql(query, engine)
-    df['percent_delayed'] = (df['delayed_flights'] / df['total_flights']) * 100
-    pivot_df = df.pivot(index='origin', columns='destination', values='percent_delayed')
-
-    fig = plt.figure(figsize=(9, 8))
-    sns.heatmap(pivot_df, cmap="Reds", linewidths=0.5)
-    plt.title('Heatmap: % Delayed Flights by Route (Origin → Destination)')
-    plt.ylabel('Origin Airport')
-    plt.xlabel('Destination Airport')
-    plt.tight_layout()
+    SELECT origin, destination, 100.0 * delayed_flights / total_flights AS percent_delayed
+    FROM mv_route_delays
+    """
+    with engine.connect() as connection:
+        rows = connection.execute(text(query)).all()
+    origins, destinations, percent_delayed = zip(*rows)
+
+    # Pivot to an origin x destination grid (sorted airports, NaN for routes without flights)
+    origin_labels, origin_index = np.unique(np.asarray(origins, dtype=np.str_), return_inverse=True)
+    destination_labels, destination_index = np.unique(np.asarray(destinations, dtype=np.str_), return_inverse=True)
+    grid = np.full((len(origin_labels), len(destination_labels)), np.nan)
+    grid[origin_index, destination_index] = percent_delayed
+
+    fig = _reusable_figure("heatmap", figsize=(9, 8))
+    ax = fig.add_subplot()
+    image = ax.imshow(grid, cmap="Reds", aspect='auto', interpolation='nearest')
+    fig.colorbar(image, ax=ax)
+
+    # Label every n-th airport so the tick labels don't overlap
+    label_step = -(-max(grid.shape) // 30)
+    ax.set_xticks(range(0, len(destination_labels), label_step))
+    ax.set_xticklabels(destination_labels[::label_step], rotation=90)
+    ax.set_yticks(range(0, len(origin_labels), label_step))
+    ax.set_yticklabels(origin_labels[::label_step])
+
+    ax.set_title('Heatmap: % Delayed Flights by Route (Origin → Destination)')
+    ax.set_ylabel('Origin Airport')
+    ax.set_xlabel('Destination Airport')
+    fig.tight_layout()
 
     return fig
 
 
-# Function to plot map of routes and save the map
+# Function to export the routes of the map and save them as GeoJSON
 def plot_map_of_routes(file_path: str):
     """
-    Generates and saves an interactive map visualizing major delayed flight routes across the USA.
-
-    Routes with more than 30% delayed flights are drawn. Routes are color-coded:
-    - Red for high delays (>50%)
-    - Orange for moderate delays (30-50%)
+    Generates and saves the major delayed flight routes across the USA as a GeoJSON FeatureCollection.
 
-    The map is saved as an HTML file at the provided file path.
+    Routes with more than 30% delayed flights are exported, each as a LineString from origin to destination
+    with the percentage of delayed flights and its line style in the properties, so the map itself
+    (static/maps/map.html) only hands the features to Leaflet:
+    - Red for high delays (>50%), orange for moderate delays (30-50%)
+    - Thicker lines for worse delays
 
     Args:
-        file_path (str): The path where the generated map will be saved.
+        file_path (str): The path where the generated GeoJSON file will be saved.
     """
-    engine = create_engine('sqlite:///flights.sqlite3')
-
-    # Get delay data
+    # Get delay data of the routes with more than 30% delayed flights, together with the airport coordinates
+    # (converted to numbers in SQL; airports without coordinates are left out)
     query = """
     SELECT 
-        flights.origin_airport AS origin,
-        flights.destination_airport AS destination,
-        COUNT(flights.id) AS total_flights,
-        SUM(CASE WHEN flights.departure_delay > 20 THEN 1 ELSE 0 END) AS delayed_flights
-    FROM flights
-    GROUP BY origin, destination
-    """
-
-    df_routes = pd.read_sql(query, engine)
-    df_routes['percent_delayed'] = (df_routes['delayed_flights'] / df_routes['total_flights']) * 100
-
-    # Get airport coordinates
-    query_airports = """
-    SELECT IATA_CODE, LATITUDE, LONGITUDE
-    FROM airports
-    WHERE IATA_CODE IS NOT NULL
-    """
-    df_airports = pd.read_sql(query_airports, engine)
-    airport_coords = df_airports.set_index('IATA_CODE')[['LATITUDE', 'LONGITUDE']].to_dict('index')
-
-    # Create the base map
-    flight_map = folium.Map(location=[39.8283, -98.5795], zoom_start=4)  # Center of USA
-
-    # Draw routes
-    for idx, row in df_routes.iterrows():
-        origin = row['origin']
-        dest = row['destination']
-        delay_percent = row['percent_delayed']
-
-        if origin not in airport_coords or dest not in airport_coords:
-            continue  # Skip if coordinates missing
-
-        # Only show meaningful delayed routes
-        if delay_percent <= 30:
-            continue  # Skip routes with low delay
-
-        origin_coords = (float(airport_coords[origin]['LATITUDE']), float(airport_coords[origin]['LONGITUDE']))
-        dest_coords = (float(airport_coords[dest]['LATITUDE']), float(airport_coords[dest]['LONGITUDE']))
-
-        # Color logic (simpler now because only bad delays shown)
-        if delay_percent > 50:
-            color = 'red'
-        else:
-            color = 'orange'
-
-        folium.PolyLine(
-            locations=[origin_coords, dest_coords],
-            color=color,
-            weight=1 + delay_percent / 40,  # Thicker for worse delay
-            opacity=0.5,
-            tooltip=f"{origin} → {dest}: {delay_percent:.1f}% delayed"
-        ).add_to(flight_map)
-
-    # Save the map to an HTML file
-    map_path = 'static/delayed_routes_map.html'
-    os.makedirs(os.path.dirname(map_path), exist_ok=True)
-    flight_map.save(file_path)
-
-    print(f"Map saved as {file_path}.")
+        routes.origin,
+        routes.destination,
+        ROUND(100.0 * routes.delayed_flights / routes.total_flights, 2) AS percent_delayed,
+        CASE WHEN 100.0 * routes.delayed_flights / routes.total_flights > 50 THEN 'red' ELSE 'orange' END AS color,
+        ROUND(1 + 100.0 * routes.delayed_flights / routes.total_flights / 40, 2) AS weight,
+        CAST(origin_airport.LATITUDE AS REAL) AS origin_latitude,
+        CAST(origin_airport.LONGITUDE AS REAL) AS origin_longitude,
+        CAST(destination_airport.LATITUDE AS REAL) AS destination_latitude,
+        CAST(destination_airport.LONGITUDE AS REAL) AS destination_longitude
+    FROM mv_route_delays AS routes
+    JOIN airports AS origin_airport ON origin_airport.IATA_CODE = routes.origin
+    JOIN airports AS destination_airport ON destination_airport.IATA_CODE = routes.destination
+    WHERE 100.0 * routes.delayed_flights / routes.total_flights > 30
+    AND origin_airport.LATITUDE != '' AND origin_airport.LONGITUDE != ''
+    AND destination_airport.LATITUDE != '' AND destination_airport.LONGITUDE != ''
+    """
+    with engine.connect() as connection:
+        rows = connection.execute(text(query)).all()
+
+    # GeoJSON coordinates are [longitude, latitude]
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": [[origin_lng, origin_lat], [dest_lng, dest_lat]]},
+            "properties": {"origin": origin, "destination": dest, "percent_delayed": delay_percent,
+                           "color": color, "weight": weight},
+        }
+        for origin, dest, delay_percent, color, weight, origin_lat, origin_lng, dest_lat, dest_lng in rows
+    ]
+
+    # Save the routes to a GeoJSON file
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with _atomic_write(file_path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+    logger.debug("Routes saved as %s.", file_path)
+
+
+# Function to render one of the figures above and save it as a PNG image
+def save_figure(plot_function, file_path: str):
+    """
+    Renders the figure created by a plot function and saves it as a PNG image.
+
+    Runs in the worker processes of the API's plot pool, so only the file path travels between processes.
+    The figures are reused by later renders, so they are drawn and saved under the figure lock.
+
+    Args:
+        plot_function: One of the plot functions above returning a matplotlib figure.
+        file_path (str): The path where the PNG image will be saved.
+    """
+    with _figures_lock:
+        fig = plot_function()
+        with _atomic_write(file_path) as f:
+            fig.savefig(f, format="png")